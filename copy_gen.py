@@ -4,14 +4,25 @@ Generates platform-optimized Facebook and Instagram posts
 from scraped listing data. Uses async Anthropic client.
 """
 
+import hashlib
 import json
-from dataclasses import dataclass
+import logging
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
 
 import anthropic
+from anthropic.types import TextBlockParam
+
+logger = logging.getLogger(__name__)
 
 MODEL = "claude-sonnet-4-20250514"
 MAX_TOKENS = 1000
 
+CACHE_DIR = Path.home() / ".cache" / "social-creator" / "copy"
+CACHE_TTL = 86400          # 24h — listings rarely change within a day
+CACHE_MAX_ENTRIES = 256
+
 
 @dataclass
 class SocialPosts:
@@ -19,24 +30,14 @@ class SocialPosts:
     instagram: str
 
 
-def _build_prompt(listing: dict) -> str:
-    """Build the copy generation prompt from listing data."""
-    features = ", ".join(listing.get("attributes", {}).keys())
-    return f"""Generate social media posts for this rental listing.
-
-LISTING DATA:
-Title: {listing.get('title', 'N/A')}
-Price: {listing.get('price', 'N/A')}
-Address: {listing.get('address', 'N/A')}
-Description: {listing.get('description', 'N/A')}
-Features: {features or 'N/A'}
+STATIC_RUBRIC = """Generate social media posts for the rental listing in the user message.
 
 Generate TWO posts:
 
 1. FACEBOOK POST:
 - Lead with the key selling point (location, price, or standout feature)
 - 80-150 words — informative but scannable
-- Include the listing link at the end: {listing.get('url', '')}
+- Include the listing link at the end
 - End with a clear CTA (e.g. "Message us to book a viewing")
 - 0-1 hashtags max (hashtags don't help on Facebook)
 - Use 2-3 relevant emoji as visual markers, not decoratively
@@ -52,7 +53,29 @@ Generate TWO posts:
 - Use 3-4 emoji as visual signposts
 
 Respond in JSON only, no markdown fences:
-{{"facebook": "post text here", "instagram": "caption text here"}}"""
+{"facebook": "post text here", "instagram": "caption text here"}"""
+
+
+def _build_prompt(listing: dict) -> tuple[list[TextBlockParam], str]:
+    """Build (system blocks, user text) for copy generation.
+
+    The rubric never varies, so it sits in its own system block ahead of
+    the listing data. Its cache_control breakpoint is inert today: the
+    rubric is ~250 tokens and Sonnet only caches prefixes of 1024+ tokens,
+    so the API ignores the marker until the system prefix passes that.
+    """
+    features = ", ".join(listing.get("attributes", {}).keys())
+    system: list[TextBlockParam] = [
+        {"type": "text", "text": STATIC_RUBRIC, "cache_control": {"type": "ephemeral"}},
+    ]
+    user = f"""LISTING DATA:
+Title: {listing.get('title', 'N/A')}
+Price: {listing.get('price', 'N/A')}
+Address: {listing.get('address', 'N/A')}
+Description: {listing.get('description', 'N/A')}
+Features: {features or 'N/A'}
+Listing link: {listing.get('url', '')}"""
+    return system, user
 
 
 def _parse_response(text: str) -> SocialPosts:
@@ -74,15 +97,74 @@ def _parse_response(text: str) -> SocialPosts:
     return SocialPosts(facebook=data["facebook"], instagram=data["instagram"])
 
 
-async def generate_posts(listing: dict) -> SocialPosts:
-    """Generate optimized Facebook and Instagram posts from listing data."""
+def _cache_key(listing: dict) -> str:
+    """Hash the exact request, so a MODEL, rubric, or template change is a miss."""
+    system, user = _build_prompt(listing)
+    payload = {"model": MODEL, "max_tokens": MAX_TOKENS, "system": system, "user": user}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _cache_get(key: str) -> SocialPosts | None:
+    """Return cached posts if present and younger than CACHE_TTL.
+
+    File mtime tracks recency for LRU eviction; the creation time
+    stored in the entry governs expiry.
+    """
+    path = CACHE_DIR / f"{key}.json"
+    try:
+        entry = json.loads(path.read_text())
+        if time.time() - entry["created"] > CACHE_TTL:
+            return None
+        posts = SocialPosts(**entry["posts"])
+    except (OSError, json.JSONDecodeError, KeyError, TypeError):
+        return None
+    try:
+        path.touch()
+    except OSError as e:
+        logger.warning("Copy cache touch failed: %s", e)
+    return posts
+
+
+def _cache_set(key: str, posts: SocialPosts) -> None:
+    """Store posts, then drop expired entries and evict least recently used.
+
+    Best-effort: an unwritable cache must not fail a paid, successful call.
+    """
+    now = time.time()
+    entry = {"created": now, "posts": asdict(posts)}
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        (CACHE_DIR / f"{key}.json").write_text(json.dumps(entry))
+        entries = sorted(CACHE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for i, path in enumerate(entries):
+            if i >= CACHE_MAX_ENTRIES or now - path.stat().st_mtime > CACHE_TTL:
+                path.unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning("Copy cache write skipped: %s", e)
+
+
+async def generate_posts(listing: dict, refresh: bool = False) -> SocialPosts:
+    """Generate optimized Facebook and Instagram posts from listing data.
+
+    Results are cached on disk by listing content, so reruns against an
+    unchanged listing skip the Claude round-trip entirely. refresh=True
+    bypasses the cached entry (e.g. "Regenerate") and replaces it.
+    """
+    key = _cache_key(listing)
+    cached = None if refresh else _cache_get(key)
+    if cached:
+        return cached
+
     client = anthropic.AsyncAnthropic()
-    prompt = _build_prompt(listing)
+    system, user = _build_prompt(listing)
 
     response = await client.messages.create(
         model=MODEL,
         max_tokens=MAX_TOKENS,
-        messages=[{"role": "user", "content": prompt}],
+        system=system,
+        messages=[{"role": "user", "content": user}],
     )
 
-    return _parse_response(response.content[0].text)
+    posts = _parse_response(response.content[0].text)
+    _cache_set(key, posts)
+    return posts
@@ -6,19 +6,41 @@ and saves to the local image directory for upload and Meta API access.
 """
 
 import asyncio
+import logging
+import multiprocessing
+import os
 import re
+import struct
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
 from dataclasses import dataclass
 from io import BytesIO
 from pathlib import Path
 
 import httpx
+from cykooz_resizer import FilterType, ResizeAlg, ResizeOptions, Resizer
 from PIL import Image
 
+logger = logging.getLogger(__name__)
+
 MIN_BYTES = 5000       # 5KB — below this is likely broken/placeholder
+MAX_BYTES = 10_000_000  # 10MB — far above any real listing photo
 MIN_WIDTH = 400
 MIN_HEIGHT = 300
-JPEG_QUALITY = 92
+JPEG_QUALITY = 85  # Indistinguishable at feed size; ~30% smaller than 92, so faster rsync too
+# Extra Huffman pass: ~5% smaller files for ~3x encode time. Off unless bandwidth-bound.
+JPEG_OPTIMIZE = os.environ.get("JPEG_OPTIMIZE", "").lower() in {"1", "true"}
 MAX_IMAGES = 20
+DOWNLOAD_CONCURRENCY = 8
+DRAFT_SIZE = (1080, 1080)  # Smallest decode that still fills a 1080-wide IG frame or FB square
+PROBE_BYTES = 8192     # Range-probe size; SOF sits in the first few KB of CDN JPEGs
+
+_LISTING_ID_RE = re.compile(r"[0-9]+")
+_ENCODE_POOL: ProcessPoolExecutor | None = None
+_RESIZER = Resizer()
+_LANCZOS = ResizeOptions(resize_alg=ResizeAlg.convolution(FilterType.lanczos3))
 
 
 @dataclass
@@ -28,26 +50,75 @@ class ProcessedImage:
     score: float
 
 
+def _jpeg_size(data: bytes) -> tuple[int, int] | None:
+    """Read (width, height) from a JPEG SOF header by walking segment markers.
+
+    Returns None for non-JPEG data or when the SOF lies beyond `data`.
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[i + 5 : i + 9])
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2 : i + 4], "big")
+    return None
+
+
 async def download_and_validate(url: str, client: httpx.AsyncClient) -> Image.Image | None:
     """Download an image and validate size/dimensions.
 
-    Returns None for broken, tiny, or placeholder images.
-    Converts RGBA/P to RGB for JPEG compatibility.
+    Returns None for broken, tiny, placeholder, oversized, or low-res images,
+    rejected as early as possible: from Content-Length before the body, from
+    the JPEG SOF header in the first chunk, or at MAX_BYTES mid-stream.
+    Only the header is parsed (in a thread); the image is returned undecoded
+    in its source mode, so dropped images never pay for decode or RGB
+    conversion.
     """
-    resp = await client.get(url)
-    resp.raise_for_status()
+    buf = BytesIO()
+    async with client.stream("GET", url) as resp:
+        resp.raise_for_status()
+        if not MIN_BYTES <= int(resp.headers.get("content-length", MIN_BYTES)) <= MAX_BYTES:
+            return None
+        async for chunk in resp.aiter_bytes(65536):
+            if not buf.tell():
+                size = _jpeg_size(chunk)
+                if size and (size[0] < MIN_WIDTH or size[1] < MIN_HEIGHT):
+                    return None
+            buf.write(chunk)
+            if buf.tell() > MAX_BYTES:
+                return None
 
-    if len(resp.content) < MIN_BYTES:
+    if buf.tell() < MIN_BYTES:
         return None
 
-    img = Image.open(BytesIO(resp.content))
+    buf.seek(0)
+    img = await asyncio.to_thread(Image.open, buf)
     if img.width < MIN_WIDTH or img.height < MIN_HEIGHT:
         return None
+    return img
 
-    if img.mode in ("RGBA", "P"):
-        img = img.convert("RGB")
 
-    return img
+async def probe_size(url: str, client: httpx.AsyncClient) -> tuple[int, int] | None:
+    """Read a JPEG's (width, height) from its first PROBE_BYTES via a Range GET.
+
+    Returns None when the size can't be determined (non-JPEG, SOF beyond the
+    probed bytes, or an error status); callers must then fetch in full.
+    """
+    headers = {"Range": f"bytes=0-{PROBE_BYTES - 1}"}
+    async with client.stream("GET", url, headers=headers) as resp:
+        if not resp.is_success:
+            return None
+        async for chunk in resp.aiter_bytes(PROBE_BYTES):
+            return _jpeg_size(chunk)
+    return None
 
 
 def score_image(img: Image.Image) -> float:
@@ -56,7 +127,10 @@ def score_image(img: Image.Image) -> float:
     Higher resolution is better (capped at 2x of 1080x1080).
     Extreme aspect ratios (too narrow or too wide) are penalized.
     """
-    w, h = img.size
+    return _score_size(*img.size)
+
+
+def _score_size(w: int, h: int) -> float:
     resolution_score = min(w * h / (1080 * 1080), 2.0)
     aspect = w / h
     aspect_score = 1.0 if 0.75 <= aspect <= 2.0 else 0.5
@@ -77,12 +151,25 @@ def _crop_to_ratio(img: Image.Image, target_ratio: float) -> Image.Image:
     return img
 
 
+def _as_rgb(img: Image.Image) -> Image.Image:
+    """RGB for JPEG output; palettes expand without a pointless dither pass."""
+    return img if img.mode == "RGB" else img.convert("RGB", dither=Image.Dither.NONE)
+
+
+def _lanczos(img: Image.Image, size: tuple[int, int]) -> Image.Image:
+    """Lanczos3 resize via SIMD (AVX2/SSE4.1/NEON) kernels into a fresh RGB buffer."""
+    dst = Image.new("RGB", size)
+    _RESIZER.resize_pil(img, dst, _LANCZOS)
+    return dst
+
+
 def resize_for_platform(img: Image.Image, platform: str = "instagram") -> Image.Image:
     """Resize for platform while preserving backward-compatible API.
 
     - instagram (default): width=1080 with IG feed aspect clamp (4:5 to 1.91:1)
     - facebook: center-cropped square 1080x1080
     """
+    img = _as_rgb(img)
     normalized = platform.lower()
     if normalized == "instagram":
         aspect = img.width / img.height
@@ -91,60 +178,201 @@ def resize_for_platform(img: Image.Image, platform: str = "instagram") -> Image.
         elif aspect < 0.8:
             img = _crop_to_ratio(img, 0.8)
         new_h = int(1080 * img.height / img.width)
-        return img.resize((1080, new_h), Image.Resampling.LANCZOS)
+        return _lanczos(img, (1080, new_h))
 
     if normalized == "facebook":
         square = _crop_to_ratio(img, 1.0)
-        return square.resize((1080, 1080), Image.Resampling.LANCZOS)
+        return _lanczos(square, (1080, 1080))
 
     raise ValueError(f"Unsupported platform: {platform}")
 
 
+def _encode_pool() -> ProcessPoolExecutor:
+    """Lazily start the shared resize/encode pool.
+
+    Spawned (not forked) workers: the parent runs asyncio and executor
+    threads, which fork does not copy safely.
+    """
+    global _ENCODE_POOL
+    if _ENCODE_POOL is None:
+        _ENCODE_POOL = ProcessPoolExecutor(
+            max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _ENCODE_POOL
+
+
+def _resize_and_save(size: tuple[int, int], pixels: bytes, save_path: Path) -> None:
+    """Process-pool worker: rebuild the image from raw RGB pixels, resize, write JPEG."""
+    resized = resize_for_platform(Image.frombytes("RGB", size, pixels))
+    resized.save(save_path, "JPEG", quality=JPEG_QUALITY, subsampling=2, optimize=JPEG_OPTIMIZE)
+
+
+async def _encode(size: tuple[int, int], pixels: bytes, save_path: Path) -> None:
+    """Run _resize_and_save in the pool, replacing the pool once if it broke.
+
+    One dead worker (OOM kill, native crash) breaks the whole executor;
+    without a rebuild every later request would fail until restart.
+    """
+    global _ENCODE_POOL
+    loop = asyncio.get_running_loop()
+    pool = _encode_pool()
+    try:
+        await loop.run_in_executor(pool, _resize_and_save, size, pixels, save_path)
+    except BrokenProcessPool:
+        logger.warning("Encode pool broke; restarting it")
+        if _ENCODE_POOL is pool:  # Concurrent callers share one rebuild
+            _ENCODE_POOL = None
+            pool.shutdown(wait=False, cancel_futures=True)
+        await loop.run_in_executor(_encode_pool(), _resize_and_save, size, pixels, save_path)
+
+
+async def _process_one(
+    index: int, img: Image.Image, score: float, listing_dir: Path, host_url: str,
+) -> ProcessedImage:
+    """Decode in a thread (libjpeg releases the GIL), then resize and save in the pool.
+
+    JPEGs are drafted first so libjpeg decodes at 1/2–1/8 scale in the DCT
+    domain when the source is at least twice DRAFT_SIZE. This happens only
+    after scoring, which must see the original dimensions. Worker processes
+    keep CPU-heavy batches from contending for the GIL with other listings
+    served by the same event loop.
+    """
+    filename = f"photo_{index}.jpg"
+    save_path = listing_dir / filename
+    img.draft("RGB", DRAFT_SIZE)
+    # Convert here, not in the worker: raw bytes can't carry a palette
+    pixels = await asyncio.to_thread(lambda: _as_rgb(img).tobytes())
+    await _encode(img.size, pixels, save_path)
+    public_url = f"{host_url}/{listing_dir.name}/{filename}" if host_url else ""
+    return ProcessedImage(local_path=save_path, public_url=public_url, score=score)
+
+
+async def _shortlist(
+    image_urls: list[str], max_images: int, client: httpx.AsyncClient, sem: asyncio.Semaphore,
+) -> tuple[list[str], list[str]]:
+    """Split URLs into (shortlist, reserve) by probed dimensions.
+
+    The shortlist is the top max_images probed JPEGs plus every URL of
+    unknown size (scored after a full download), in page order. The
+    reserve is the remaining probed candidates, best first, for topping up
+    when shortlisted downloads fail. Probes share the download semaphore.
+    """
+    if len(image_urls) <= max_images:
+        return image_urls, []
+
+    async def probe(url: str) -> tuple[int, int] | None:
+        async with sem:
+            return await probe_size(url, client)
+
+    sizes = await asyncio.gather(*[probe(url) for url in image_urls], return_exceptions=True)
+    ranked = [
+        url for _, url in sorted(
+            (
+                (_score_size(*size), url) for url, size in zip(image_urls, sizes)
+                if isinstance(size, tuple) and size[0] >= MIN_WIDTH and size[1] >= MIN_HEIGHT
+            ),
+            key=lambda x: x[0], reverse=True,
+        )
+    ]
+    keep = set(ranked[:max_images])
+    keep.update(url for url, size in zip(image_urls, sizes) if not isinstance(size, tuple))
+    return [url for url in image_urls if url in keep], ranked[max_images:]
+
+
+def make_client() -> httpx.AsyncClient:
+    """HTTP/2 client sized for concurrent CDN downloads; share it across listings."""
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=30,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        headers={"User-Agent": "Mozilla/5.0"},
+    )
+
+
 async def select_and_prepare_images(
     image_urls: list[str],
     listing_id: str,
     local_dir: str,
     max_images: int = MAX_IMAGES,
     host_url: str = "",
+    on_progress: Callable[[int, int], None] | None = None,
+    client: httpx.AsyncClient | None = None,
 ) -> dict[str, list[ProcessedImage]]:
     """Download, score, resize, and save listing images.
 
     Saves resized images to {local_dir}/tm-{listing_id}/.
-    Returns {"hero": [top image], "carousel": [top N images]}.
-    When host_url is provided, public_url is set for each image.
+    Returns {"hero": [top image], "carousel": [top N images]}, ties
+    broken by position in image_urls. When host_url is provided,
+    public_url is set for each image. on_progress(done, total) is called
+    as each download finishes, successful or not. Pass a long-lived
+    `client` to keep CDN connections warm across listings; without one,
+    a client is opened for this call only.
     """
-    if not re.match(r'^\d+$', listing_id):
+    if not _LISTING_ID_RE.fullmatch(listing_id):
         raise ValueError(f"Invalid listing_id: {listing_id}")
     listing_dir = Path(local_dir) / f"tm-{listing_id}"
     listing_dir.mkdir(parents=True, exist_ok=True)
 
-    # Download and score all images concurrently
-    scored: list[tuple[Image.Image, float, str]] = []
-    async with httpx.AsyncClient(timeout=30, headers={"User-Agent": "Mozilla/5.0"}) as client:
-        tasks = [download_and_validate(url, client) for url in image_urls]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+    # Probe dimensions, download the shortlist concurrently, then decode and
+    # encode the best. Downloads that fail are topped up from the next-best
+    # probed URLs; decodes that fail (corrupt or truncated files only surface
+    # at first pixel access) from the next-best downloaded image.
+    position = {url: i for i, url in reversed(list(enumerate(image_urls)))}
+    pending: list[tuple[Image.Image, float, str]] = []
+    processed: list[ProcessedImage] = []
+    attempted = 0
+    async with nullcontext(client) if client else make_client() as client:
+        sem = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+        urls, reserve = await _shortlist(image_urls, max_images, client, sem)
+        done = 0
+        total = len(urls)
 
-    for url, result in zip(image_urls, results):
-        if isinstance(result, Image.Image):
-            scored.append((result, score_image(result), url))
+        async def fetch(url: str) -> Image.Image | None:
+            nonlocal done
+            async with sem:
+                try:
+                    return await download_and_validate(url, client)
+                finally:
+                    done += 1
+                    if on_progress:
+                        on_progress(done, total)
 
-    scored.sort(key=lambda x: x[1], reverse=True)
-    scored = scored[:max_images]
+        while len(processed) < max_images:
+            wanted = max_images - len(processed)
+            if len(pending) < wanted and (urls or reserve):
+                if not urls:
+                    missing = wanted - len(pending)
+                    urls, reserve = reserve[:missing], reserve[missing:]
+                    total += len(urls)
+                results = await asyncio.gather(*[fetch(url) for url in urls], return_exceptions=True)
+                pending += [
+                    (result, score_image(result), url)
+                    for url, result in zip(urls, results) if isinstance(result, Image.Image)
+                ]
+                # Equal scores keep the page's carousel order, so the
+                # listing's own lead photo wins ties for hero
+                pending.sort(key=lambda x: (-x[1], position[x[2]]))
+                urls = []
+                continue
+            if not pending:
+                break
 
-    # Resize and save
-    processed: list[ProcessedImage] = []
-    for i, (img, sc, _url) in enumerate(scored, 1):
-        resized = resize_for_platform(img)
-        filename = f"photo_{i}.jpg"
-        save_path = listing_dir / filename
-        resized.save(save_path, "JPEG", quality=JPEG_QUALITY, optimize=True)
-        public_url = f"{host_url}/{listing_dir.name}/{filename}" if host_url else ""
-        processed.append(ProcessedImage(
-            local_path=save_path,
-            public_url=public_url,
-            score=sc,
-        ))
+            batch, pending = pending[:wanted], pending[wanted:]
+            outcomes = await asyncio.gather(
+                *[_process_one(attempted + i, img, sc, listing_dir, host_url)
+                  for i, (img, sc, _url) in enumerate(batch, 1)],
+                return_exceptions=True,
+            )
+            for i, ((_img, _sc, url), outcome) in enumerate(zip(batch, outcomes), attempted + 1):
+                if isinstance(outcome, ProcessedImage):
+                    processed.append(outcome)
+                else:
+                    logger.warning("Dropping %s: %s", url, outcome)
+                    (listing_dir / f"photo_{i}.jpg").unlink(missing_ok=True)
+            attempted += len(batch)
 
+    # Top-ups can outscore earlier picks; keep the best first for hero
+    processed.sort(key=lambda p: p.score, reverse=True)
     return {
         "hero": processed[:1],
         "carousel": processed,
@@ -5,13 +5,40 @@ Instagram requires publicly accessible HTTPS image URLs.
 """
 
 import asyncio
+import json
 import logging
+import random
+import time
 
 import httpx
 
 logger = logging.getLogger(__name__)
 
 BASE = "https://graph.facebook.com/v22.0"
+UPLOAD_CONCURRENCY = 6
+MAX_ATTEMPTS = 5
+MAX_RETRY_DELAY = 8  # seconds; caps Retry-After at the largest backoff step
+RATE_LIMITED = 429  # Request was rejected unprocessed, so any call may retry it
+TRANSIENT_STATUSES = {500, 502, 503, 504}  # May have been processed; safe only if idempotent
+USAGE_BACKOFF_PCT = 90  # Meta throttles at 100% of any usage metric
+_USAGE_METRICS = ("call_count", "total_cputime", "total_time")
+
+
+def _usage_pct(resp: httpx.Response) -> float:
+    """Highest utilisation reported by Meta's X-App-Usage / X-Business-Use-Case-Usage headers.
+
+    Meta mostly signals throttling through these rather than Retry-After.
+    Missing or malformed headers count as 0.
+    """
+    buckets: list[dict] = []
+    try:
+        if app := resp.headers.get("X-App-Usage"):
+            buckets.append(json.loads(app))
+        if buc := resp.headers.get("X-Business-Use-Case-Usage"):
+            buckets.extend(entry for entries in json.loads(buc).values() for entry in entries)
+        return max((float(b.get(m, 0)) for b in buckets for m in _USAGE_METRICS), default=0.0)
+    except (ValueError, TypeError, AttributeError):
+        return 0.0
 
 
 class ContainerError(Exception):
@@ -25,35 +52,72 @@ class MetaPublisher:
         self.token = page_token
         self.client = httpx.AsyncClient(timeout=30)
 
-    async def _api(self, method: str, endpoint: str, **kwargs: object) -> dict:
-        """Meta API request with error logging."""
-        resp = await self.client.request(method, f"{BASE}/{endpoint}", **kwargs)
+    async def _api(self, method: str, endpoint: str, *, publishes: bool = False, **kwargs: object) -> dict:
+        """Meta API request with error logging.
+
+        Rate-limited responses are retried up to MAX_ATTEMPTS times, waiting
+        Retry-After seconds (capped at MAX_RETRY_DELAY) when given, the full
+        MAX_RETRY_DELAY when usage headers report USAGE_BACKOFF_PCT or more,
+        else 1s, 2s, 4s, ... plus jitter. Transient 5xx responses are retried the
+        same way unless `publishes` is set: a gateway 502/504 can arrive after
+        Meta created the post, so retrying would publish it twice.
+        Only the final failure raises.
+        """
+        retry_statuses = {RATE_LIMITED} if publishes else {RATE_LIMITED, *TRANSIENT_STATUSES}
+        for attempt in range(MAX_ATTEMPTS):
+            resp = await self.client.request(method, f"{BASE}/{endpoint}", **kwargs)
+            if resp.status_code not in retry_statuses or attempt == MAX_ATTEMPTS - 1:
+                break
+            retry_after = resp.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = min(float(retry_after), MAX_RETRY_DELAY)
+            elif _usage_pct(resp) >= USAGE_BACKOFF_PCT:
+                delay = MAX_RETRY_DELAY  # Near quota: quick retries would only burn more of it
+            else:
+                delay = 2 ** attempt
+            logger.warning(
+                "Meta API %s %s → %s; retry %d in %.1fs",
+                method, endpoint, resp.status_code, attempt + 1, delay,
+            )
+            await asyncio.sleep(delay + random.uniform(0, 0.5))
+
         if not resp.is_success:
             logger.error("Meta API %s %s → %s: %s", method, endpoint, resp.status_code, resp.text)
         resp.raise_for_status()
         return resp.json()
 
+    async def _post_all(self, endpoint: str, payloads: list[dict[str, str]]) -> list[dict]:
+        """POST each payload concurrently (at most UPLOAD_CONCURRENCY in flight).
+
+        Results are returned in payload order so carousel order is preserved.
+        """
+        sem = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+        async def post(data: dict[str, str]) -> dict:
+            async with sem:
+                return await self._api("POST", endpoint, data=data)
+
+        return await asyncio.gather(*[post(data) for data in payloads])
+
     async def post_facebook(self, image_urls: list[str], message: str) -> dict:
         """Post to Facebook — single image or multi-image post."""
         if len(image_urls) == 1:
             return await self._api(
-                "POST", f"{self.page_id}/photos",
+                "POST", f"{self.page_id}/photos", publishes=True,
                 data={"url": image_urls[0], "message": message, "access_token": self.token},
             )
 
-        photo_ids: list[str] = []
-        for url in image_urls:
-            result = await self._api(
-                "POST", f"{self.page_id}/photos",
-                data={"url": url, "published": "false", "access_token": self.token},
-            )
-            photo_ids.append(result["id"])
+        uploads = await self._post_all(
+            f"{self.page_id}/photos",
+            [{"url": url, "published": "false", "access_token": self.token} for url in image_urls],
+        )
+        photo_ids = [result["id"] for result in uploads]
 
         data: dict[str, str] = {"message": message, "access_token": self.token}
         for i, pid in enumerate(photo_ids):
             data[f"attached_media[{i}]"] = f'{{"media_fbid":"{pid}"}}'
 
-        return await self._api("POST", f"{self.page_id}/feed", data=data)
+        return await self._api("POST", f"{self.page_id}/feed", publishes=True, data=data)
 
     async def post_instagram(self, image_urls: list[str], caption: str) -> dict:
         """Post to Instagram — single image or carousel."""
@@ -64,20 +128,17 @@ class MetaPublisher:
             )
             await self._wait_for_container(result["id"])
             return await self._api(
-                "POST", f"{self.ig_user_id}/media_publish",
+                "POST", f"{self.ig_user_id}/media_publish", publishes=True,
                 data={"creation_id": result["id"], "access_token": self.token},
             )
 
-        children: list[str] = []
-        for url in image_urls:
-            result = await self._api(
-                "POST", f"{self.ig_user_id}/media",
-                data={"image_url": url, "is_carousel_item": "true", "access_token": self.token},
-            )
-            children.append(result["id"])
+        containers = await self._post_all(
+            f"{self.ig_user_id}/media",
+            [{"image_url": url, "is_carousel_item": "true", "access_token": self.token} for url in image_urls],
+        )
+        children = [result["id"] for result in containers]
 
-        for child_id in children:
-            await self._wait_for_container(child_id)
+        await asyncio.gather(*[self._wait_for_container(child_id) for child_id in children])
 
         result = await self._api(
             "POST", f"{self.ig_user_id}/media",
@@ -91,32 +152,31 @@ class MetaPublisher:
         await self._wait_for_container(result["id"])
 
         return await self._api(
-            "POST", f"{self.ig_user_id}/media_publish",
+            "POST", f"{self.ig_user_id}/media_publish", publishes=True,
             data={"creation_id": result["id"], "access_token": self.token},
         )
 
-    async def _wait_for_container(self, container_id: str, max_wait: int = 30) -> None:
-        """Poll until an Instagram media container finishes processing."""
+    async def _wait_for_container(self, container_id: str, max_wait: float = 30) -> None:
+        """Poll until an Instagram media container finishes processing.
+
+        Polls back off from 0.25s to 2s: containers usually finish within a
+        few seconds, so early polls catch them fast and later ones stay cheap.
+        """
         last_payload: dict | None = None
-        for _ in range(max_wait):
-            resp = await self.client.get(
-                f"{BASE}/{container_id}",
+        delay = 0.25
+        deadline = time.monotonic() + max_wait
+        while time.monotonic() < deadline:
+            last_payload = await self._api(
+                "GET", container_id,
                 params={"fields": "status_code", "access_token": self.token},
             )
-            if not resp.is_success:
-                logger.error(
-                    "Meta API GET %s → %s: %s",
-                    container_id, resp.status_code, resp.text,
-                )
-                resp.raise_for_status()
-
-            last_payload = resp.json()
             status = last_payload.get("status_code")
             if status == "FINISHED":
                 return
             if status == "ERROR":
                 raise ContainerError(f"Container {container_id} failed: {last_payload}")
-            await asyncio.sleep(1)
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.6, 2.0)
         raise TimeoutError(
             f"Container {container_id} not ready after {max_wait}s (last payload: {last_payload})"
         )
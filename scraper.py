@@ -1,50 +1,58 @@
-"""TradeMe single-listing scraper using async Playwright.
+"""TradeMe single-listing scraper: plain HTTP first, async Playwright fallback.
 
 Extraction priority: JSON-LD → __NEXT_DATA__ → DOM fallback.
 Photo IDs extracted from trademe.tmcdn.co.nz/photoserver URLs and
 reconstructed as full-size /plus/ URLs.
 """
 
-import json
+import asyncio
+import logging
 import re
 
-from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeout
+import httpx
+import orjson
+from playwright.async_api import (
+    Browser, Playwright, Route, async_playwright, TimeoutError as PlaywrightTimeout,
+)
 from bs4 import BeautifulSoup
 
 from utils import validate_trademe_url
 
+logger = logging.getLogger(__name__)
+
+_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+_BLOCKED_RESOURCES = {"image", "media", "font", "stylesheet"}
+_LISTING_ID_RE = re.compile(r"/listing/([0-9]+)")
+_PRICE_RE = re.compile(r"\$[\d,]+.*?week", re.IGNORECASE)
+_DESC_CLASS_RE = re.compile(r"description|Description|listing-body|ListingBody")
+_BED_RE = re.compile(r"(\d+)\s*bed")
+_BATH_RE = re.compile(r"(\d+)\s*bath")
+_PHOTO_ID_RE = re.compile(r"trademe\.tmcdn\.co\.nz/photoserver/(?:[^\"'\s]*?/)?([0-9]+)\.jpg")
+
 
 def _extract_listing_id(url: str) -> str:
     """Pull the numeric listing ID from a TradeMe URL."""
-    match = re.search(r"/listing/(\d+)", url)
+    match = _LISTING_ID_RE.search(url)
     if not match:
         raise ValueError(f"No listing ID found in URL: {url}")
     return match.group(1)
 
 
 def _photo_ids_from_html(html: str) -> list[str]:
-    """Extract unique photo IDs from all img tags referencing the TradeMe CDN.
+    """Extract unique photo IDs from TradeMe CDN URLs anywhere in the page.
 
-    Checks both src and data-src for lazy-loaded images.
+    One regex scan over the raw HTML covers src, data-src, and lazy-load
+    attributes without building a second DOM. Page order is preserved.
     Pattern ported from property-partner-site/scraper/scraper.py.
     """
-    soup = BeautifulSoup(html, "html.parser")
-    ids: set[str] = set()
-    for img in soup.find_all("img"):
-        for attr in ("src", "data-src"):
-            src = img.get(attr, "")
-            if "trademe.tmcdn.co.nz/photoserver" in src:
-                match = re.search(r"/(\d+)\.jpg", src)
-                if match:
-                    ids.add(match.group(1))
-    return list(ids)
-
-
-def _parse_json_ld(raw: str) -> dict | None:
+    return list(dict.fromkeys(_PHOTO_ID_RE.findall(html)))
+
+
+def _parse_json_ld(raw: str | None) -> dict | None:
     """Try to extract listing fields from JSON-LD structured data."""
     try:
-        data = json.loads(raw)
-    except (json.JSONDecodeError, TypeError):
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError:
         return None
 
     # JSON-LD can be a list or single object
@@ -61,11 +69,11 @@ def _parse_json_ld(raw: str) -> dict | None:
     }
 
 
-def _parse_next_data(raw: str) -> dict | None:
+def _parse_next_data(raw: str | None) -> dict | None:
     """Try to extract listing fields from Next.js __NEXT_DATA__ blob."""
     try:
-        blob = json.loads(raw)
-    except (json.JSONDecodeError, TypeError):
+        blob = orjson.loads(raw)
+    except orjson.JSONDecodeError:
         return None
 
     # Navigate the props tree — structure varies, so walk common paths
@@ -97,31 +105,22 @@ def _parse_dom(soup: BeautifulSoup) -> dict:
         if len(parts) >= 2:
             address = ", ".join(parts[-2:])
 
-    # Price: look for "$X per week"
-    price = None
-    for elem in soup.find_all(["div", "span", "p"]):
-        txt = elem.get_text()
-        if "$" in txt and "week" in txt.lower():
-            m = re.search(r"\$[\d,]+.*?week", txt, re.IGNORECASE)
-            if m:
-                price = m.group(0)
-                break
+    # Price: first "$X per week" in the page text (one text pass, no per-element scan)
+    page_text = soup.get_text()
+    price_match = _PRICE_RE.search(page_text)
+    price = price_match.group(0) if price_match else None
 
     # Description
-    description = None
-    for sel in ("description", "Description", "listing-body", "ListingBody"):
-        el = soup.find(attrs={"class": re.compile(sel)})
-        if el:
-            description = el.get_text(strip=True)
-            break
+    desc_el = soup.find(attrs={"class": _DESC_CLASS_RE})
+    description = desc_el.get_text(strip=True) if desc_el else None
 
     # Attributes (beds, baths, etc.)
     attributes: dict[str, str] = {}
-    body_text = soup.get_text().lower()
-    bed_match = re.search(r"(\d+)\s*bed", body_text)
+    body_text = page_text.lower()
+    bed_match = _BED_RE.search(body_text)
     if bed_match:
         attributes["bedrooms"] = bed_match.group(1)
-    bath_match = re.search(r"(\d+)\s*bath", body_text)
+    bath_match = _BATH_RE.search(body_text)
     if bath_match:
         attributes["bathrooms"] = bath_match.group(1)
 
@@ -134,24 +133,52 @@ def _parse_dom(soup: BeautifulSoup) -> dict:
     }
 
 
-async def scrape_trademe_listing(url: str) -> dict:
-    """Scrape a single TradeMe rental listing.
+class TradeMeScraper:
+    """Headless Chromium shared across listings.
 
-    Returns dict with keys: url, listing_id, title, price, address,
-    description, images (full-size CDN URLs), attributes.
+    The browser launches on first use and lives until the context manager
+    exits; each listing gets a fresh browser context. Images, media, fonts,
+    and stylesheets are aborted — only the HTML and its img src attributes
+    are read, so downloading them is pure waste.
     """
-    safe_url = validate_trademe_url(url)
-    listing_id = _extract_listing_id(safe_url)
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
+    def __init__(self) -> None:
+        self._playwright: Playwright | None = None
+        self._browser: Browser | None = None
+        self._launch_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "TradeMeScraper":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
         try:
-            context = await browser.new_context(
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-                viewport={"width": 1920, "height": 1080},
-            )
+            if self._browser:
+                await self._browser.close()
+        finally:
+            if self._playwright:
+                await self._playwright.stop()
+            self._browser = self._playwright = None
+
+    async def _get_browser(self) -> Browser:
+        """Return the shared browser, relaunching it if Chromium crashed or disconnected."""
+        async with self._launch_lock:
+            if self._browser is None or not self._browser.is_connected():
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(headless=True)
+        return self._browser
+
+    async def fetch_html(self, url: str) -> str:
+        """Render a listing page and return its HTML after lazy images resolve."""
+        browser = await self._get_browser()
+        context = await browser.new_context(
+            user_agent=_USER_AGENT,
+            viewport={"width": 1920, "height": 1080},
+        )
+        try:
+            await context.route("**/*", _block_heavy_resources)
             page = await context.new_page()
-            await page.goto(safe_url, wait_until="domcontentloaded", timeout=30000)
+            await page.goto(url, wait_until="domcontentloaded", timeout=30000)
             try:
                 await page.wait_for_selector("h1", timeout=10000)
             except PlaywrightTimeout:
@@ -163,18 +190,71 @@ async def scrape_trademe_listing(url: str) -> dict:
             await page.evaluate("window.scrollTo(0, 0)")
             await page.wait_for_timeout(1000)
 
-            html = await page.content()
+            return await page.content()
         finally:
-            await browser.close()
+            await context.close()
+
+
+async def _block_heavy_resources(route: Route) -> None:
+    if route.request.resource_type in _BLOCKED_RESOURCES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def _try_http(url: str) -> str | None:
+    """Fetch the server-rendered page without a browser.
+
+    TradeMe's Next.js SSR embeds the listing in __NEXT_DATA__ and photo
+    URLs in the initial HTML. Returns None on any failure or when either is
+    missing, so the caller falls back to Playwright.
+    """
+    try:
+        async with httpx.AsyncClient(
+            timeout=15, follow_redirects=True, headers={"User-Agent": _USER_AGENT},
+        ) as client:
+            resp = await client.get(url)
+    except httpx.HTTPError as e:
+        logger.info("Plain HTTP fetch failed for %s (%s); using Playwright", url, e)
+        return None
+    if not resp.is_success:
+        logger.info("Plain HTTP fetch got %s for %s; using Playwright", resp.status_code, url)
+        return None
+
+    html = resp.text
+    if 'id="__NEXT_DATA__"' not in html or not _PHOTO_ID_RE.search(html):
+        return None
+    return html
+
+
+async def scrape_trademe_listing(url: str, scraper: TradeMeScraper | None = None) -> dict:
+    """Scrape a single TradeMe rental listing.
+
+    Tries a plain HTTP fetch first; Chromium is only used when the SSR
+    HTML lacks the data. Pass a long-lived `scraper` to reuse its browser
+    across listings; without one, a browser is launched for this call only.
+
+    Returns dict with keys: url, listing_id, title, price, address,
+    description, images (full-size CDN URLs), attributes.
+    """
+    safe_url = validate_trademe_url(url)
+    listing_id = _extract_listing_id(safe_url)
+
+    html = await _try_http(safe_url)
+    if html is None and scraper:
+        html = await scraper.fetch_html(safe_url)
+    elif html is None:
+        async with TradeMeScraper() as one_shot:
+            html = await one_shot.fetch_html(safe_url)
 
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, "lxml")
 
     # Parse all tiers, merge best fields from each
     json_ld_tag = soup.find("script", type="application/ld+json")
     next_tag = soup.find("script", id="__NEXT_DATA__")
     tiers = [
-        _parse_json_ld(json_ld_tag.string if json_ld_tag else None),
-        _parse_next_data(next_tag.string if next_tag else None),
+        _parse_json_ld(json_ld_tag.get_text() if json_ld_tag else None),
+        _parse_next_data(next_tag.get_text() if next_tag else None),
         _parse_dom(soup),
     ]
     fields: dict = {}
@@ -1,8 +1,14 @@
 """Tests for copy_gen.py — prompt building and response parsing."""
 
+from types import SimpleNamespace
+
 import pytest
 
-from copy_gen import SocialPosts, _build_prompt, _parse_response
+import copy_gen
+from copy_gen import (
+    STATIC_RUBRIC, SocialPosts, _build_prompt, _cache_get, _cache_key, _cache_set,
+    _parse_response, generate_posts,
+)
 
 
 SAMPLE_LISTING = {
@@ -18,7 +24,7 @@ SAMPLE_LISTING = {
 # -- _build_prompt --
 
 def test_prompt_contains_all_fields():
-    prompt = _build_prompt(SAMPLE_LISTING)
+    _, prompt = _build_prompt(SAMPLE_LISTING)
     assert "2 Bedroom Apartment" in prompt
     assert "$450 per week" in prompt
     assert "Riccarton, Christchurch" in prompt
@@ -30,17 +36,27 @@ def test_prompt_contains_all_fields():
 def test_prompt_handles_missing_keys():
     """Sparse listing should produce a valid prompt without crashing."""
     sparse = {"url": "https://trademe.co.nz/listing/1"}
-    prompt = _build_prompt(sparse)
+    _, prompt = _build_prompt(sparse)
     assert "N/A" in prompt
     assert "trademe.co.nz" in prompt
 
 
 def test_prompt_handles_empty_attributes():
     listing = {**SAMPLE_LISTING, "attributes": {}}
-    prompt = _build_prompt(listing)
+    _, prompt = _build_prompt(listing)
     assert "Features: N/A" in prompt
 
 
+def test_prompt_rubric_is_static():
+    """System block is identical across listings, with listing data kept out of it."""
+    system, _ = _build_prompt(SAMPLE_LISTING)
+    other, _ = _build_prompt({"url": "https://trademe.co.nz/listing/1"})
+    assert system == other
+    assert system[0]["text"] == STATIC_RUBRIC
+    assert system[0]["cache_control"] == {"type": "ephemeral"}
+    assert "Riccarton" not in STATIC_RUBRIC
+
+
 # -- _parse_response --
 
 def test_parse_clean_json():
@@ -79,3 +95,90 @@ def test_parse_missing_instagram_key_raises():
 def test_parse_invalid_json_raises():
     with pytest.raises(Exception):
         _parse_response("not json at all")
+
+
+# -- response cache --
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(copy_gen, "CACHE_DIR", tmp_path)
+    return tmp_path
+
+
+def test_cache_key_ignores_unrelated_fields():
+    assert _cache_key(SAMPLE_LISTING) == _cache_key({**SAMPLE_LISTING, "images": ["x"]})
+    assert _cache_key(SAMPLE_LISTING) != _cache_key({**SAMPLE_LISTING, "price": "$500 per week"})
+
+
+@pytest.mark.parametrize(("name", "value"), [("STATIC_RUBRIC", "Write one post."), ("MODEL", "other-model")])
+def test_cache_key_changes_with_prompt_or_model(monkeypatch, name: str, value: str):
+    """Editing the rubric or switching models must not serve stale copy."""
+    before = _cache_key(SAMPLE_LISTING)
+    monkeypatch.setattr(copy_gen, name, value)
+    assert _cache_key(SAMPLE_LISTING) != before
+
+
+def test_cache_roundtrip(cache_dir):
+    posts = SocialPosts(facebook="FB", instagram="IG")
+    _cache_set("abc", posts)
+    assert _cache_get("abc") == posts
+    assert _cache_get("missing") is None
+
+
+def test_cache_expired_entry_is_miss(cache_dir, monkeypatch):
+    _cache_set("abc", SocialPosts(facebook="FB", instagram="IG"))
+    monkeypatch.setattr(copy_gen, "CACHE_TTL", -1)
+    assert _cache_get("abc") is None
+
+
+def test_cache_evicts_beyond_max_entries(cache_dir, monkeypatch):
+    monkeypatch.setattr(copy_gen, "CACHE_MAX_ENTRIES", 2)
+    for key in ("a", "b", "c"):
+        _cache_set(key, SocialPosts(facebook=key, instagram=key))
+    assert len(list(cache_dir.glob("*.json"))) == 2
+
+
+@pytest.mark.asyncio
+async def test_generate_posts_cache_hit_skips_api(cache_dir, monkeypatch):
+    posts = SocialPosts(facebook="FB", instagram="IG")
+    _cache_set(_cache_key(SAMPLE_LISTING), posts)
+
+    def _fail() -> None:
+        raise AssertionError("Anthropic client should not be created on a cache hit")
+
+    monkeypatch.setattr(copy_gen.anthropic, "AsyncAnthropic", _fail)
+    assert await generate_posts(SAMPLE_LISTING) == posts
+
+
+class _FakeAnthropic:
+    """Stands in for AsyncAnthropic; counts messages.create calls."""
+
+    def __init__(self, text: str) -> None:
+        self.messages = self
+        self.calls = 0
+        self._response = SimpleNamespace(content=[SimpleNamespace(text=text)])
+
+    async def create(self, **kwargs: object) -> SimpleNamespace:
+        self.calls += 1
+        return self._response
+
+
+@pytest.mark.asyncio
+async def test_generate_posts_refresh_bypasses_and_replaces_cache(cache_dir, monkeypatch):
+    _cache_set(_cache_key(SAMPLE_LISTING), SocialPosts(facebook="old", instagram="old"))
+    client = _FakeAnthropic('{"facebook": "new FB", "instagram": "new IG"}')
+    monkeypatch.setattr(copy_gen.anthropic, "AsyncAnthropic", lambda: client)
+
+    posts = await generate_posts(SAMPLE_LISTING, refresh=True)
+
+    assert posts == SocialPosts(facebook="new FB", instagram="new IG")
+    assert client.calls == 1
+    assert _cache_get(_cache_key(SAMPLE_LISTING)) == posts
+
+
+def test_cache_set_unwritable_dir_is_skipped(tmp_path, monkeypatch):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    monkeypatch.setattr(copy_gen, "CACHE_DIR", blocker / "copy")  # mkdir under a file fails
+    _cache_set("abc", SocialPosts(facebook="FB", instagram="IG"))
+    assert _cache_get("abc") is None
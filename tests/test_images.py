@@ -1,13 +1,19 @@
 """Tests for images.py — scoring, resizing, and download validation."""
 
+import asyncio
+import os
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
-from unittest.mock import AsyncMock
 
 import httpx
 import pytest
-from PIL import Image
+import pytest_asyncio
+from PIL import Image, features
 
-from images import download_and_validate, resize_for_platform, score_image
+import images
+from images import _jpeg_size, _resize_and_save, _shortlist, download_and_validate, resize_for_platform, score_image
 
 
 def _make_image(width: int, height: int, mode: str = "RGB") -> Image.Image:
@@ -15,6 +21,21 @@ def _make_image(width: int, height: int, mode: str = "RGB") -> Image.Image:
     return Image.new(mode, (width, height), color="red")
 
 
+@pytest_asyncio.fixture
+async def client_returning() -> AsyncIterator[Callable[[bytes], httpx.AsyncClient]]:
+    """Factory for clients whose every request returns 200 with the given body."""
+    clients: list[httpx.AsyncClient] = []
+
+    def make(content: bytes) -> httpx.AsyncClient:
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, content=content))
+        clients.append(httpx.AsyncClient(transport=transport))
+        return clients[-1]
+
+    yield make
+    for client in clients:
+        await client.aclose()
+
+
 def _image_to_bytes(img: Image.Image, fmt: str = "JPEG") -> bytes:
     buf = BytesIO()
     rgb = img.convert("RGB") if img.mode != "RGB" else img
@@ -22,6 +43,11 @@ def _image_to_bytes(img: Image.Image, fmt: str = "JPEG") -> bytes:
     return buf.getvalue()
 
 
+def test_pillow_linked_against_libjpeg_turbo():
+    """Decode/encode speed assumes the SIMD libjpeg-turbo that official wheels bundle."""
+    assert features.check_feature("libjpeg_turbo")
+
+
 # -- score_image --
 
 def test_high_res_beats_low_res():
@@ -90,79 +116,288 @@ def test_facebook_resize_is_square():
     assert resized.size == (1080, 1080)
 
 
+@pytest.mark.parametrize("mode", ["RGBA", "P", "L"])
+def test_resize_outputs_rgb_for_any_mode(mode: str):
+    assert resize_for_platform(_make_image(1200, 900, mode)).mode == "RGB"
+
+
 def test_unknown_platform_raises():
     img = _make_image(1000, 1000)
     with pytest.raises(ValueError, match="Unsupported platform"):
         resize_for_platform(img, "linkedin")
 
 
+def test_resize_and_save_writes_jpeg_from_raw_pixels(tmp_path):
+    """Pool worker rebuilds the image from raw bytes and writes the resized JPEG."""
+    img = _make_image(2000, 1500)
+    path = tmp_path / "photo_1.jpg"
+    _resize_and_save(img.size, img.tobytes(), path)
+    with Image.open(path) as saved:
+        assert saved.format == "JPEG"
+        assert saved.size == (1080, 810)
+
+
+class _BrokenPool(Executor):
+    """Executor in the state a ProcessPoolExecutor is left in after a worker dies."""
+
+    def __init__(self) -> None:
+        self.shut_down = False
+
+    def submit(self, fn, /, *args, **kwargs):
+        raise BrokenProcessPool("worker died")
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        self.shut_down = True
+
+
+@pytest.mark.asyncio
+async def test_encode_rebuilds_broken_pool(tmp_path, monkeypatch):
+    """A dead worker must not poison every later request until restart."""
+    broken = _BrokenPool()
+    replacement = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(images, "_ENCODE_POOL", broken)
+    monkeypatch.setattr(images, "ProcessPoolExecutor", lambda **kwargs: replacement)
+
+    img = _make_image(2000, 1500)
+    path = tmp_path / "photo_1.jpg"
+    await images._encode(img.size, img.tobytes(), path)
+    replacement.shutdown()
+
+    assert broken.shut_down
+    assert images._ENCODE_POOL is replacement
+    assert path.exists()
+
+
+# -- _jpeg_size --
+
+@pytest.mark.parametrize("progressive", [False, True])
+def test_jpeg_size_reads_sof_header(progressive: bool):
+    buf = BytesIO()
+    _make_image(1234, 567).save(buf, "JPEG", progressive=progressive)
+    assert _jpeg_size(buf.getvalue()) == (1234, 567)
+
+
+def test_jpeg_size_non_jpeg_returns_none():
+    assert _jpeg_size(_image_to_bytes(_make_image(10, 10), "PNG")) is None
+    assert _jpeg_size(b"\xff\xd8\xff") is None
+
+
 # -- download_and_validate --
 
 @pytest.mark.asyncio
-async def test_download_too_small_returns_none():
+async def test_download_too_small_returns_none(client_returning):
     """Images under 5KB should be rejected."""
     tiny = b"\xff\xd8\xff\xe0" + b"\x00" * 100  # Not a real JPEG but tiny
-    client = AsyncMock(spec=httpx.AsyncClient)
-    resp = AsyncMock()
-    resp.content = tiny
-    resp.raise_for_status = lambda: None
-    client.get.return_value = resp
+    client = client_returning(tiny)
 
     result = await download_and_validate("http://example.com/img.jpg", client)
     assert result is None
 
 
 @pytest.mark.asyncio
-async def test_download_small_dimensions_returns_none():
+@pytest.mark.parametrize("length", ["100", "50000000"])
+async def test_download_out_of_range_content_length_skips_body(length: str):
+    """A tiny or oversized Content-Length rejects the image before the body is streamed."""
+    class UnreadableStream(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            raise AssertionError("body should not be read")
+            yield b""
+
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, headers={"Content-Length": length}, stream=UnreadableStream())
+    )
+    async with httpx.AsyncClient(transport=transport) as client:
+        assert await download_and_validate("http://example.com/img.jpg", client) is None
+
+
+@pytest.mark.asyncio
+async def test_download_small_dimensions_returns_none(client_returning):
     """Images below 400x300 should be rejected."""
     img = _make_image(100, 100)
     content = _image_to_bytes(img)
 
-    client = AsyncMock(spec=httpx.AsyncClient)
-    resp = AsyncMock()
-    resp.content = content
-    resp.raise_for_status = lambda: None
-    client.get.return_value = resp
+    client = client_returning(content)
 
     result = await download_and_validate("http://example.com/img.jpg", client)
     assert result is None
 
 
 @pytest.mark.asyncio
-async def test_download_rgba_converts_to_rgb():
-    """RGBA images should be converted to RGB for JPEG compat."""
+async def test_download_rgba_defers_rgb_conversion(client_returning):
+    """RGBA images are returned as-is; conversion waits for resize_for_platform."""
     # Use noise so PNG doesn't compress below 5KB threshold
-    import random
-    img = Image.new("RGBA", (800, 600))
-    pixels = [tuple(random.randint(0, 255) for _ in range(4)) for _ in range(800 * 600)]
-    img.putdata(pixels)
+    img = Image.frombuffer("RGBA", (800, 600), os.urandom(800 * 600 * 4), "raw", "RGBA", 0, 1)
     content = BytesIO()
     img.save(content, "PNG")
     content = content.getvalue()
 
-    client = AsyncMock(spec=httpx.AsyncClient)
-    resp = AsyncMock()
-    resp.content = content
-    resp.raise_for_status = lambda: None
-    client.get.return_value = resp
+    client = client_returning(content)
 
     result = await download_and_validate("http://example.com/img.png", client)
     assert result is not None
-    assert result.mode == "RGB"
+    assert result.mode == "RGBA"
+    assert resize_for_platform(result).mode == "RGB"
 
 
 @pytest.mark.asyncio
-async def test_download_valid_image_returns_image():
+async def test_download_valid_image_returns_image(client_returning):
     """A valid, large-enough image should be returned."""
     img = _make_image(1200, 900)
     content = _image_to_bytes(img)
 
-    client = AsyncMock(spec=httpx.AsyncClient)
-    resp = AsyncMock()
-    resp.content = content
-    resp.raise_for_status = lambda: None
-    client.get.return_value = resp
+    client = client_returning(content)
 
     result = await download_and_validate("http://example.com/img.jpg", client)
     assert result is not None
     assert result.size == (1200, 900)
+
+
+@pytest.mark.asyncio
+async def test_download_oversized_body_returns_none(monkeypatch, client_returning):
+    """Bodies past MAX_BYTES are abandoned mid-stream."""
+    monkeypatch.setattr(images, "MAX_BYTES", 10_000)
+    content = _image_to_bytes(_make_image(1200, 900)) + b"\x00" * 20_000
+    client = client_returning(content)
+
+    result = await download_and_validate("http://example.com/img.jpg", client)
+    assert result is None
+
+
+# -- _shortlist --
+
+@pytest.mark.asyncio
+async def test_shortlist_keeps_top_probed_and_unknown_sizes():
+    """Range probes rank JPEGs by size; unprobeable images are kept for a full fetch."""
+    bodies = {
+        "/small.jpg": _image_to_bytes(_make_image(300, 200)),
+        "/mid.jpg": _image_to_bytes(_make_image(1200, 900)),
+        "/big.jpg": _image_to_bytes(_make_image(2000, 1500)),
+        "/big2.jpg": _image_to_bytes(_make_image(1800, 1400)),
+        "/photo.png": _image_to_bytes(_make_image(800, 600), "PNG"),
+    }
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = bodies[request.url.path]
+        assert request.headers["Range"].startswith("bytes=0-")
+        return httpx.Response(206, content=body[:images.PROBE_BYTES])
+
+    urls = [f"http://example.com{path}" for path in bodies]
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        shortlist, reserve = await _shortlist(urls, 2, client, asyncio.Semaphore(8))
+
+    assert shortlist == [
+        "http://example.com/big.jpg", "http://example.com/big2.jpg", "http://example.com/photo.png",
+    ]
+    assert reserve == ["http://example.com/mid.jpg"]
+
+
+@pytest.mark.asyncio
+async def test_shortlist_skips_probes_when_under_limit():
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise AssertionError("no probe expected")
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        assert await _shortlist(["http://example.com/a.jpg"], 5, client, asyncio.Semaphore(8)) == (
+            ["http://example.com/a.jpg"], [],
+        )
+
+
+@pytest.mark.asyncio
+async def test_shortlist_probes_respect_semaphore():
+    in_flight = peak = 0
+    body = _image_to_bytes(_make_image(1200, 900))[: images.PROBE_BYTES]
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(206, content=body)
+
+    urls = [f"http://example.com/{i}.jpg" for i in range(10)]
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        await _shortlist(urls, 2, client, asyncio.Semaphore(3))
+    assert peak == 3
+
+
+# -- select_and_prepare_images --
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("listing_id", ["", "12/../x", "\u0661\u0662\u0663"])
+async def test_select_rejects_invalid_listing_ids(tmp_path, listing_id: str):
+    with pytest.raises(ValueError, match="Invalid listing_id"):
+        await images.select_and_prepare_images([], listing_id, str(tmp_path))
+
+
+def _noise_jpeg(width: int, height: int) -> bytes:
+    """JPEG that stays large when encoded, so a truncated copy still passes MIN_BYTES."""
+    return _image_to_bytes(Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)))
+
+
+@pytest.mark.asyncio
+async def test_select_drops_truncated_image_and_tops_up(tmp_path, monkeypatch):
+    """A corrupt file fails only at pixel decode; it must not abort the listing."""
+    full = _noise_jpeg(2000, 1500)
+    bodies = {
+        "/truncated.jpg": full[: len(full) // 2],
+        "/a.jpg": _noise_jpeg(1600, 1200),
+        "/b.jpg": _noise_jpeg(1200, 900),
+        "/c.jpg": _noise_jpeg(800, 600),
+    }
+
+    monkeypatch.setattr(images, "_encode", lambda *args: asyncio.to_thread(_resize_and_save, *args))
+    async with httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, content=bodies[request.url.path]))
+    ) as client:
+        result = await images.select_and_prepare_images(
+            [f"http://example.com{path}" for path in bodies], "1", str(tmp_path), max_images=2, client=client,
+        )
+
+    assert [p.local_path.name for p in result["carousel"]] == ["photo_2.jpg", "photo_3.jpg"]
+    assert sorted(p.name for p in (tmp_path / "tm-1").iterdir()) == ["photo_2.jpg", "photo_3.jpg"]
+
+
+@pytest.mark.asyncio
+async def test_select_backfills_failed_shortlisted_downloads(tmp_path, monkeypatch):
+    """A shortlisted photo that 404s is replaced by the next-best probed candidate."""
+    bodies = {
+        "/big.jpg": _image_to_bytes(_make_image(2000, 1500)),
+        "/mid.jpg": _image_to_bytes(_make_image(1600, 1200)),
+        "/small.jpg": _image_to_bytes(_make_image(1200, 900)),
+    }
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = bodies[request.url.path]
+        if "Range" in request.headers:
+            return httpx.Response(206, content=body[:images.PROBE_BYTES])
+        if request.url.path == "/big.jpg":
+            return httpx.Response(404)
+        return httpx.Response(200, content=body)
+
+    async def fake_process(index, img, score, listing_dir, host_url):
+        return images.ProcessedImage(local_path=listing_dir / f"{img.size[0]}.jpg", public_url="", score=score)
+
+    monkeypatch.setattr(images, "_process_one", fake_process)
+    progress: list[tuple[int, int]] = []
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        result = await images.select_and_prepare_images(
+            [f"http://example.com{path}" for path in bodies], "1", str(tmp_path),
+            max_images=2, client=client, on_progress=lambda done, total: progress.append((done, total)),
+        )
+
+    assert [p.local_path.name for p in result["carousel"]] == ["1600.jpg", "1200.jpg"]
+    assert progress[-1] == (3, 3)
+
+
+@pytest.mark.asyncio
+async def test_select_uses_and_keeps_open_a_passed_client(tmp_path, client_returning):
+    """A shared client serves the downloads and stays open for the next listing."""
+    client = client_returning(_image_to_bytes(_make_image(100, 100)))
+
+    result = await images.select_and_prepare_images(
+        ["http://example.com/a.jpg"], "1", str(tmp_path), client=client,
+    )
+
+    assert result == {"hero": [], "carousel": []}
+    assert not client.is_closed
@@ -0,0 +1,208 @@
+"""Tests for publisher.py — Meta Graph API call sequencing."""
+
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+import publisher
+from publisher import ContainerError, MetaPublisher
+
+
+def _publisher(handler) -> MetaPublisher:
+    pub = MetaPublisher(page_id="page", ig_user_id="ig", page_token="token")
+    pub.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return pub
+
+
+def _form(request: httpx.Request) -> dict[str, str]:
+    return {k: v[0] for k, v in parse_qs(request.content.decode()).items()}
+
+
+@pytest.mark.asyncio
+async def test_facebook_multi_photo_preserves_order():
+    """Concurrent unpublished uploads must attach in the original order."""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        form = _form(request)
+        if request.url.path.endswith("/photos"):
+            # Later images finish first to prove ordering doesn't follow completion
+            await asyncio.sleep(0.01 * (3 - int(form["url"][-1])))
+            return httpx.Response(200, json={"id": f"photo{form['url'][-1]}"})
+        return httpx.Response(200, json={"id": "post", "form": form})
+
+    pub = _publisher(handler)
+    result = await pub.post_facebook(["https://x/1", "https://x/2", "https://x/3"], "msg")
+    await pub.close()
+
+    attached = [json.loads(result["form"][f"attached_media[{i}]"])["media_fbid"] for i in range(3)]
+    assert attached == ["photo1", "photo2", "photo3"]
+
+
+@pytest.mark.asyncio
+async def test_instagram_carousel_children_in_order():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            return httpx.Response(200, json={"status_code": "FINISHED"})
+        form = _form(request)
+        if form.get("is_carousel_item"):
+            return httpx.Response(200, json={"id": f"child{form['image_url'][-1]}"})
+        if form.get("media_type") == "CAROUSEL":
+            assert form["children"] == "child1,child2"
+            return httpx.Response(200, json={"id": "carousel"})
+        return httpx.Response(200, json={"id": "published"})
+
+    pub = _publisher(handler)
+    result = await pub.post_instagram(["https://x/1", "https://x/2"], "caption")
+    await pub.close()
+    assert result == {"id": "published"}
+
+
+@pytest.mark.asyncio
+async def test_wait_for_container_polls_until_finished():
+    statuses = iter(["IN_PROGRESS", "IN_PROGRESS", "FINISHED"])
+    polls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        polls.append(request)
+        return httpx.Response(200, json={"status_code": next(statuses)})
+
+    pub = _publisher(handler)
+    await pub._wait_for_container("c1")
+    await pub.close()
+    assert len(polls) == 3
+
+
+@pytest.mark.asyncio
+async def test_wait_for_container_error_raises():
+    pub = _publisher(lambda request: httpx.Response(200, json={"status_code": "ERROR"}))
+    with pytest.raises(ContainerError):
+        await pub._wait_for_container("c1")
+    await pub.close()
+
+
+@pytest.mark.asyncio
+async def test_wait_for_container_times_out():
+    pub = _publisher(lambda request: httpx.Response(200, json={"status_code": "IN_PROGRESS"}))
+    with pytest.raises(TimeoutError, match="not ready"):
+        await pub._wait_for_container("c1", max_wait=0.3)
+    await pub.close()
+
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(publisher.random, "uniform", lambda a, b: 0.0)
+
+
+@pytest.mark.asyncio
+async def test_api_retries_rate_limit_then_succeeds(no_jitter):
+    responses = iter([
+        httpx.Response(429, headers={"Retry-After": "0"}),
+        httpx.Response(503, headers={"Retry-After": "0"}),
+        httpx.Response(200, json={"id": "ok"}),
+    ])
+    pub = _publisher(lambda request: next(responses))
+    assert await pub._api("POST", "page/photos") == {"id": "ok"}
+    await pub.close()
+
+
+@pytest.mark.asyncio
+async def test_api_raises_after_exhausting_retries(no_jitter):
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(503, headers={"Retry-After": "0"})
+
+    pub = _publisher(handler)
+    with pytest.raises(httpx.HTTPStatusError):
+        await pub._api("POST", "page/photos")
+    await pub.close()
+    assert len(calls) == publisher.MAX_ATTEMPTS
+
+
+@pytest.mark.asyncio
+async def test_api_does_not_retry_client_errors():
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(400, json={"error": "bad"})
+
+    pub = _publisher(handler)
+    with pytest.raises(httpx.HTTPStatusError):
+        await pub._api("POST", "page/photos")
+    await pub.close()
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_publish_call_does_not_retry_gateway_errors():
+    """A 502 on a publish may mean the post exists; retrying could duplicate it."""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(502)
+
+    pub = _publisher(handler)
+    with pytest.raises(httpx.HTTPStatusError):
+        await pub.post_facebook(["https://x/1"], "msg")
+    await pub.close()
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_publish_call_retries_rate_limit(no_jitter):
+    responses = iter([httpx.Response(429, headers={"Retry-After": "0"}), httpx.Response(200, json={"id": "post"})])
+    pub = _publisher(lambda request: next(responses))
+    assert await pub._api("POST", "page/feed", publishes=True) == {"id": "post"}
+    await pub.close()
+
+
+@pytest.mark.asyncio
+async def test_api_caps_retry_after(no_jitter, monkeypatch):
+    sleeps = []
+
+    async def fake_sleep(delay: float) -> None:
+        sleeps.append(delay)
+
+    monkeypatch.setattr(publisher.asyncio, "sleep", fake_sleep)
+    responses = iter([httpx.Response(429, headers={"Retry-After": "3600"}), httpx.Response(200, json={})])
+    pub = _publisher(lambda request: next(responses))
+    await pub._api("GET", "c1")
+    await pub.close()
+    assert sleeps == [publisher.MAX_RETRY_DELAY]
+
+
+@pytest.mark.parametrize(
+    ("headers", "expected"),
+    [
+        ({}, 0.0),
+        ({"X-App-Usage": '{"call_count": 12, "total_cputime": 95, "total_time": 40}'}, 95.0),
+        ({"X-Business-Use-Case-Usage": '{"123": [{"type": "pages", "call_count": 97, "total_time": 5}]}'}, 97.0),
+        ({"X-App-Usage": "not json"}, 0.0),
+    ],
+)
+def test_usage_pct_reads_meta_usage_headers(headers: dict[str, str], expected: float):
+    assert publisher._usage_pct(httpx.Response(200, headers=headers)) == expected
+
+
+@pytest.mark.asyncio
+async def test_api_backs_off_fully_when_usage_is_high(no_jitter, monkeypatch):
+    sleeps = []
+
+    async def fake_sleep(delay: float) -> None:
+        sleeps.append(delay)
+
+    monkeypatch.setattr(publisher.asyncio, "sleep", fake_sleep)
+    responses = iter([
+        httpx.Response(503, headers={"X-App-Usage": '{"call_count": 50}'}),
+        httpx.Response(503, headers={"X-App-Usage": '{"call_count": 96}'}),
+        httpx.Response(200, json={}),
+    ])
+    pub = _publisher(lambda request: next(responses))
+    await pub._api("GET", "c1")
+    await pub.close()
+    assert sleeps == [1, publisher.MAX_RETRY_DELAY]
@@ -1,7 +1,16 @@
-"""Tests for scraper URL validation helpers."""
+"""Tests for scraper URL validation helpers and HTML extraction."""
 
+from types import SimpleNamespace
+
+import httpx
 import pytest
+from bs4 import BeautifulSoup
 
+import scraper
+from scraper import (
+    TradeMeScraper, _block_heavy_resources, _parse_dom, _parse_next_data, _photo_ids_from_html,
+    scrape_trademe_listing,
+)
 from utils import validate_trademe_url
 
 
@@ -26,3 +35,224 @@ def test_validate_trademe_url_accepts_subdomain():
 def test_validate_trademe_url_rejects_non_trademe_hosts_or_invalid_scheme(url: str):
     with pytest.raises(ValueError, match="trademe.co.nz|http\\(s\\) TradeMe"):
         validate_trademe_url(url)
+
+
+def test_photo_ids_deduped_in_page_order():
+    html = """
+    <img src="https://trademe.tmcdn.co.nz/photoserver/thumb/222.jpg">
+    <img data-src="https://trademe.tmcdn.co.nz/photoserver/plus/111.jpg">
+    <img src="https://trademe.tmcdn.co.nz/photoserver/full/222.jpg">
+    <img src="https://trademe.tmcdn.co.nz/photoserver/333.jpg">
+    <img src="https://example.com/photoserver/444.jpg">
+    """
+    assert _photo_ids_from_html(html) == ["222", "111", "333"]
+
+
+def test_parse_next_data_reads_listing_props():
+    raw = '{"props": {"pageProps": {"listing": {"title": "Flat", "priceDisplay": "$500 per week"}}}}'
+    assert _parse_next_data(raw) == {
+        "title": "Flat", "description": None, "address": None, "price": "$500 per week",
+    }
+
+
+@pytest.mark.parametrize("raw", [None, "", "{not json"])
+def test_parse_next_data_invalid_returns_none(raw: str | None):
+    assert _parse_next_data(raw) is None
+
+
+def test_parse_dom_fallback_fields():
+    html = """
+    <h1>Sunny Flat, Riccarton, Christchurch</h1>
+    <div><span>$450</span> per week</div>
+    <div class="tm-ListingBody">Close to shops.</div>
+    <p>3 bedrooms, 2 bathrooms</p>
+    """
+    assert _parse_dom(BeautifulSoup(html, "lxml")) == {
+        "title": "Sunny Flat, Riccarton, Christchurch",
+        "description": "Close to shops.",
+        "address": "Riccarton, Christchurch",
+        "price": "$450 per week",
+        "attributes": {"bedrooms": "3", "bathrooms": "2"},
+    }
+
+
+# -- TradeMeScraper browser lifecycle --
+
+class _FakeBrowser:
+    def __init__(self, close_error: Exception | None = None) -> None:
+        self.connected = True
+        self.close_error = close_error
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def close(self) -> None:
+        if self.close_error:
+            raise self.close_error
+
+
+class _FakePlaywright:
+    """Stands in for async_playwright(): start() → playwright, chromium.launch() → browser."""
+
+    def __init__(self, close_error: Exception | None = None) -> None:
+        self.chromium = self
+        self.launched: list[_FakeBrowser] = []
+        self.stopped = False
+        self.close_error = close_error
+
+    async def start(self) -> "_FakePlaywright":
+        return self
+
+    async def launch(self, headless: bool) -> _FakeBrowser:
+        self.launched.append(_FakeBrowser(self.close_error))
+        return self.launched[-1]
+
+    async def stop(self) -> None:
+        self.stopped = True
+
+
+@pytest.fixture
+def fake_playwright(monkeypatch) -> _FakePlaywright:
+    pw = _FakePlaywright()
+    monkeypatch.setattr(scraper, "async_playwright", lambda: pw)
+    return pw
+
+
+@pytest.mark.asyncio
+async def test_browser_reused_across_listings(fake_playwright):
+    async with TradeMeScraper() as tm:
+        assert await tm._get_browser() is await tm._get_browser()
+    assert len(fake_playwright.launched) == 1
+    assert fake_playwright.stopped
+
+
+@pytest.mark.asyncio
+async def test_browser_relaunched_after_disconnect(fake_playwright):
+    async with TradeMeScraper() as tm:
+        first = await tm._get_browser()
+        first.connected = False  # Chromium crashed
+        second = await tm._get_browser()
+    assert second is not first
+    assert len(fake_playwright.launched) == 2
+
+
+@pytest.mark.asyncio
+async def test_playwright_stopped_even_if_browser_close_fails(monkeypatch):
+    pw = _FakePlaywright(close_error=RuntimeError("browser gone"))
+    monkeypatch.setattr(scraper, "async_playwright", lambda: pw)
+    with pytest.raises(RuntimeError, match="browser gone"):
+        async with TradeMeScraper() as tm:
+            await tm._get_browser()
+    assert pw.stopped
+
+
+class _FakeRoute:
+    def __init__(self, resource_type: str) -> None:
+        self.request = SimpleNamespace(resource_type=resource_type)
+        self.outcome = ""
+
+    async def abort(self) -> None:
+        self.outcome = "abort"
+
+    async def continue_(self) -> None:
+        self.outcome = "continue"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("resource_type", "outcome"),
+    [("image", "abort"), ("font", "abort"), ("stylesheet", "abort"), ("media", "abort"),
+     ("document", "continue"), ("script", "continue"), ("xhr", "continue")],
+)
+async def test_block_heavy_resources(resource_type: str, outcome: str):
+    route = _FakeRoute(resource_type)
+    await _block_heavy_resources(route)
+    assert route.outcome == outcome
+
+
+# -- plain HTTP first, browser fallback --
+
+LISTING_URL = "https://www.trademe.co.nz/a/property/residential/rent/listing/4812345678"
+SSR_HTML = """<html><body><h1>Sunny Flat</h1>
+<script id="__NEXT_DATA__" type="application/json">
+{"props": {"pageProps": {"listing": {"title": "Sunny Flat", "priceDisplay": "$500 per week"}}}}
+</script>
+<img src="https://trademe.tmcdn.co.nz/photoserver/plus/111.jpg">
+</body></html>"""
+
+
+class _FakeScraper:
+    """Stands in for TradeMeScraper: records fetch_html calls, returns SSR_HTML."""
+
+    instances: list["_FakeScraper"] = []
+
+    def __init__(self) -> None:
+        self.fetched: list[str] = []
+        _FakeScraper.instances.append(self)
+
+    async def __aenter__(self) -> "_FakeScraper":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        pass
+
+    async def fetch_html(self, url: str) -> str:
+        self.fetched.append(url)
+        return SSR_HTML
+
+
+@pytest.fixture
+def serve_http(monkeypatch):
+    """Route _try_http's client through a MockTransport with the given handler."""
+    real_client = httpx.AsyncClient
+
+    def install(handler) -> None:
+        monkeypatch.setattr(
+            scraper.httpx, "AsyncClient",
+            lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs),
+        )
+
+    _FakeScraper.instances = []
+    monkeypatch.setattr(scraper, "TradeMeScraper", _FakeScraper)
+    return install
+
+
+@pytest.mark.asyncio
+async def test_ssr_hit_skips_browser(serve_http):
+    serve_http(lambda request: httpx.Response(200, text=SSR_HTML))
+    listing = await scrape_trademe_listing(LISTING_URL)
+    assert listing["title"] == "Sunny Flat"
+    assert listing["images"] == ["https://trademe.tmcdn.co.nz/photoserver/plus/111.jpg"]
+    assert _FakeScraper.instances == []
+
+
+def _raise_connect_error(request: httpx.Request) -> httpx.Response:
+    raise httpx.ConnectError("refused", request=request)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "handler",
+    [
+        lambda request: httpx.Response(503),
+        _raise_connect_error,
+        lambda request: httpx.Response(200, text=SSR_HTML.replace("__NEXT_DATA__", "other")),
+        lambda request: httpx.Response(200, text=SSR_HTML.replace("photoserver", "elsewhere")),
+    ],
+    ids=["non-2xx", "http-error", "no-next-data", "no-photos"],
+)
+async def test_http_miss_falls_back_to_passed_scraper(serve_http, handler):
+    serve_http(handler)
+    shared = _FakeScraper()
+    listing = await scrape_trademe_listing(LISTING_URL, scraper=shared)
+    assert shared.fetched == [LISTING_URL]
+    assert _FakeScraper.instances == [shared]  # No one-shot browser
+    assert listing["images"] == ["https://trademe.tmcdn.co.nz/photoserver/plus/111.jpg"]
+
+
+@pytest.mark.asyncio
+async def test_http_miss_without_scraper_uses_one_shot_browser(serve_http):
+    serve_http(lambda request: httpx.Response(404))
+    await scrape_trademe_listing(LISTING_URL)
+    [one_shot] = _FakeScraper.instances
+    assert one_shot.fetched == [LISTING_URL]
@@ -0,0 +1,65 @@
+"""Tests for utils.py — listing-dir validation, remote ops argv, and local cleanup."""
+
+import pytest
+
+import utils
+
+
+@pytest.fixture
+def calls(monkeypatch) -> list[tuple[str, ...]]:
+    recorded: list[tuple[str, ...]] = []
+
+    async def fake_run(*args: str) -> str:
+        recorded.append(args)
+        return ""
+
+    monkeypatch.setattr(utils, "run_subprocess", fake_run)
+    return recorded
+
+
+@pytest.mark.parametrize("listing_dir", ["tm-", "tm-1\n", "tm-1/../x", "../tm-1", "tm-\u0661\u0662\u0663"])
+def test_safe_listing_dir_rejects_non_exact_matches(listing_dir: str):
+    with pytest.raises(ValueError, match="Invalid listing_dir"):
+        utils._safe_listing_dir(listing_dir)
+
+
+@pytest.mark.asyncio
+async def test_upload_and_cleanup_share_ssh_control_master(calls):
+    await utils.upload_images("tm-1")
+    await utils.cleanup_remote("tm-1")
+
+    rsync, ssh = calls
+    assert rsync[rsync.index("-e") + 1] == " ".join(("ssh", *utils.SSH_OPTS))
+    assert ssh[: len(utils.SSH_OPTS) + 1] == ("ssh", *utils.SSH_OPTS)
+    assert "ControlMaster=auto" in utils.SSH_OPTS
+
+
+def test_cleanup_local_sweeps_only_tm_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "LOCAL_IMAGE_DIR", str(tmp_path))
+    (tmp_path / "tm-1").mkdir()
+    (tmp_path / "tm-1" / "01.jpg").write_bytes(b"x")
+    (tmp_path / "keep").mkdir()
+    (tmp_path / "tm-file").write_bytes(b"x")
+    outside = tmp_path.parent / f"{tmp_path.name}-outside"
+    outside.mkdir()
+    (tmp_path / "tm-link").symlink_to(outside)
+
+    utils.cleanup_local()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["keep", "tm-file", "tm-link"]
+    assert outside.exists()
+
+
+def test_cleanup_local_sweep_logs_failed_deletions(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(utils, "LOCAL_IMAGE_DIR", str(tmp_path))
+    (tmp_path / "tm-1").mkdir()
+    (tmp_path / "tm-1" / "01.jpg").write_bytes(b"x")
+
+    def deny(*args: object, **kwargs: object) -> None:
+        raise PermissionError("read-only")
+
+    monkeypatch.setattr(utils.os, "unlink", deny)
+    utils.cleanup_local()
+
+    assert "01.jpg" in caplog.text
+    assert "read-only" in caplog.text
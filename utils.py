@@ -1,14 +1,19 @@
 """Shared config, remote ops, and cleanup."""
 
 import asyncio
+import logging
 import os
 import re
 import shutil
+import sys
+from collections.abc import Callable
 from pathlib import Path
 from urllib.parse import urlparse
 
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 PROJECT_ROOT = Path(__file__).resolve().parent
 load_dotenv(PROJECT_ROOT / ".env")
 
@@ -17,6 +22,9 @@ load_dotenv(PROJECT_ROOT / ".env")
 REMOTE_HOST = "hetzner-chch"
 REMOTE_IMAGE_DIR = "/var/www/propertypartner/listings"
 PUBLIC_IMAGE_BASE = "https://propertypartner.co.nz/listings"
+# Multiplex rsync/ssh over one authenticated connection kept alive for 60s,
+# so a listing's upload → cleanup pair pays for a single handshake
+SSH_OPTS = ("-o", "ControlMaster=auto", "-o", "ControlPath=~/.ssh/cm-%C", "-o", "ControlPersist=60s")
 
 _env_dir = os.environ.get("IMAGE_LOCAL_DIR", "")
 _fallback = str(PROJECT_ROOT / "output" / "images")
@@ -29,6 +37,7 @@ except PermissionError:
 
 
 TRADEME_HOST = "trademe.co.nz"
+LISTING_DIR_RE = re.compile(r"tm-[0-9]+")  # Not \d: that also matches non-ASCII digits
 
 
 def validate_trademe_url(url: str) -> str:
@@ -59,17 +68,22 @@ async def run_subprocess(*args: str) -> str:
 
 def _safe_listing_dir(listing_dir: str) -> str:
     """Validate listing_dir to prevent path traversal."""
-    if not re.match(r'^tm-\d+$', listing_dir):
+    if not LISTING_DIR_RE.fullmatch(listing_dir):
         raise ValueError(f"Invalid listing_dir: {listing_dir}")
     return listing_dir
 
 
 async def upload_images(listing_dir: str) -> None:
-    """Rsync a listing's images to the server. --delete removes stale files."""
+    """Rsync a listing's images to the server. --delete removes stale files.
+
+    No -z and no delta transfer: JPEGs are already entropy-coded and freshly
+    encoded each run, so compression and rolling checksums are pure CPU cost.
+    """
     listing_dir = _safe_listing_dir(listing_dir)
     local = Path(LOCAL_IMAGE_DIR) / listing_dir
     await run_subprocess(
-        "rsync", "-az", "--delete", str(local) + "/",
+        "rsync", "-a", "--delete", "--whole-file", "-e", " ".join(("ssh", *SSH_OPTS)),
+        str(local) + "/",
         f"{REMOTE_HOST}:{REMOTE_IMAGE_DIR}/{listing_dir}/",
     )
 
@@ -77,7 +91,20 @@ async def upload_images(listing_dir: str) -> None:
 async def cleanup_remote(listing_dir: str) -> None:
     """Delete a listing's images from the server."""
     listing_dir = _safe_listing_dir(listing_dir)
-    await run_subprocess("ssh", REMOTE_HOST, "rm", "-rf", f"{REMOTE_IMAGE_DIR}/{listing_dir}")
+    await run_subprocess("ssh", *SSH_OPTS, REMOTE_HOST, "rm", "-rf", f"{REMOTE_IMAGE_DIR}/{listing_dir}")
+
+
+def _log_rmtree_error(func: Callable[..., object], path: str, exc: BaseException) -> None:
+    """Best-effort sweep: log each path that can't be removed and keep going."""
+    logger.warning("Local cleanup: %s(%s) failed: %s", func.__name__, path, exc)
+
+
+def _rmtree_logged(path: str) -> None:
+    # onerror is deprecated from 3.12 (the deploy target); 3.11 has only onerror
+    if sys.version_info >= (3, 12):
+        shutil.rmtree(path, onexc=_log_rmtree_error)
+    else:
+        shutil.rmtree(path, onerror=lambda func, p, exc_info: _log_rmtree_error(func, p, exc_info[1]))
 
 
 def cleanup_local(listing_dir: str | None = None) -> None:
@@ -87,8 +114,9 @@ def cleanup_local(listing_dir: str | None = None) -> None:
         target = base / _safe_listing_dir(listing_dir)
         if target.exists():
             shutil.rmtree(target)
-    else:
-        if base.exists():
-            for child in base.iterdir():
-                if child.is_dir() and child.name.startswith("tm-"):
-                    shutil.rmtree(child)
+    elif base.exists():
+        # DirEntry caches the type from the directory read; no stat per child
+        with os.scandir(base) as entries:
+            for entry in entries:
+                if entry.name.startswith("tm-") and entry.is_dir(follow_symlinks=False):
+                    _rmtree_logged(entry.path)
@@ -4,10 +4,9 @@ SSE streams for long-running scrape/image tasks.
 JSON endpoints for copy generation and publishing.
 """
 
-import json
+import asyncio
 import logging
 import os
-import re
 import sys
 import time
 from contextlib import asynccontextmanager
@@ -15,6 +14,7 @@ from pathlib import Path
 from typing import AsyncGenerator
 from urllib.parse import urlparse
 
+import orjson
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
@@ -25,26 +25,30 @@ PROJECT_ROOT = Path(__file__).resolve().parents[2]
 sys.path.insert(0, str(PROJECT_ROOT))
 
 from utils import (
-    LOCAL_IMAGE_DIR, PUBLIC_IMAGE_BASE,
+    LISTING_DIR_RE, LOCAL_IMAGE_DIR, PUBLIC_IMAGE_BASE,
     upload_images, cleanup_remote, cleanup_local,
     validate_trademe_url,
 )
-from scraper import scrape_trademe_listing
-from images import select_and_prepare_images
+from scraper import TradeMeScraper, scrape_trademe_listing
+from images import make_client, select_and_prepare_images
 from copy_gen import generate_posts
 from publisher import MetaPublisher
 
 
 logger = logging.getLogger(__name__)
-LISTING_DIR_RE = re.compile(r"^tm-\d+$")
 MANAGED_LISTING_DIRS: set[str] = set()
+# Cleanups for aborted image streams; held so they aren't garbage-collected mid-run
+_PENDING_CLEANUPS: set[asyncio.Task[None]] = set()
 
 # --- App ---
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
-    cleanup_local()
-    yield
+    await asyncio.to_thread(cleanup_local)
+    async with TradeMeScraper() as scraper, make_client() as client:
+        app.state.scraper = scraper
+        app.state.client = client
+        yield
 
 app = FastAPI(lifespan=lifespan)
 
@@ -67,6 +71,7 @@ class ImagesRequest(BaseModel):
 
 class CopyRequest(BaseModel):
     listing: dict
+    refresh: bool = False
 
 class PublishRequest(BaseModel):
     facebook_caption: str | None = None
@@ -76,8 +81,14 @@ class PublishRequest(BaseModel):
 
 # --- Helpers ---
 
-def sse_event(event: str, data: dict) -> str:
-    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+def sse_event(event: str, data: dict) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+async def _cleanup_after(task: asyncio.Task, listing_dir: str) -> None:
+    """Let a cancelled pipeline unwind, then delete its partial local output."""
+    await asyncio.gather(task, return_exceptions=True)
+    await asyncio.to_thread(cleanup_local, listing_dir)
 
 
 def _extract_listing_dir_from_public_url(image_url: str) -> str | None:
@@ -103,7 +114,7 @@ def _extract_listing_dir_from_public_url(image_url: str) -> str | None:
 
 @app.post("/api/scrape")
 async def scrape(req: ScrapeRequest) -> StreamingResponse:
-    async def stream() -> AsyncGenerator[str, None]:
+    async def stream() -> AsyncGenerator[bytes, None]:
         try:
             safe_url = validate_trademe_url(req.url)
         except ValueError as e:
@@ -112,7 +123,7 @@ async def scrape(req: ScrapeRequest) -> StreamingResponse:
 
         yield sse_event("progress", {"step": "scraping", "message": "Connecting to TradeMe..."})
         try:
-            listing = await scrape_trademe_listing(safe_url)
+            listing = await scrape_trademe_listing(safe_url, app.state.scraper)
             yield sse_event("progress", {"step": "scraping", "message": f"Found {len(listing.get('images', []))} images"})
             yield sse_event("complete", {"listing": listing})
         except Exception as e:
@@ -123,13 +134,26 @@ async def scrape(req: ScrapeRequest) -> StreamingResponse:
 
 @app.post("/api/images")
 async def process_images(req: ImagesRequest) -> StreamingResponse:
-    async def stream() -> AsyncGenerator[str, None]:
+    async def stream() -> AsyncGenerator[bytes, None]:
         listing_dir = f"tm-{req.listing_id}"
         yield sse_event("progress", {"step": "images", "message": f"Downloading {len(req.image_urls)} images..."})
+        downloads: asyncio.Queue[tuple[int, int]] = asyncio.Queue()
+        task = asyncio.create_task(select_and_prepare_images(
+            req.image_urls, req.listing_id, LOCAL_IMAGE_DIR,
+            on_progress=lambda done, total: downloads.put_nowait((done, total)),
+            client=app.state.client,
+        ))
+        next_download = asyncio.ensure_future(downloads.get())
+        cleaned = False
         try:
-            result = await select_and_prepare_images(
-                req.image_urls, req.listing_id, LOCAL_IMAGE_DIR,
-            )
+            # Relay one progress event per finished download until the pipeline completes
+            while not task.done():
+                await asyncio.wait({task, next_download}, return_when=asyncio.FIRST_COMPLETED)
+                if next_download.done():
+                    done, total = next_download.result()
+                    yield sse_event("progress", {"step": "images", "message": f"Downloaded {done}/{total} images"})
+                    next_download = asyncio.ensure_future(downloads.get())
+            result = task.result()
             yield sse_event("progress", {"step": "images", "message": "Uploading to server..."})
             await upload_images(listing_dir)
             MANAGED_LISTING_DIRS.add(listing_dir)
@@ -143,9 +167,18 @@ async def process_images(req: ImagesRequest) -> StreamingResponse:
             }
             yield sse_event("progress", {"step": "images", "message": f"Prepared {len(result['carousel'])} images"})
             yield sse_event("complete", {"images": serialized})
-            cleanup_local(listing_dir)
+            await asyncio.to_thread(cleanup_local, listing_dir)
+            cleaned = True
         except Exception as e:
             yield sse_event("error", {"message": str(e)})
+        finally:
+            next_download.cancel()
+            task.cancel()  # No-op once finished; stops work if the client disconnects
+            if not cleaned and LISTING_DIR_RE.fullmatch(listing_dir):
+                # Awaiting here would be re-cancelled on disconnect, so clean up in the background
+                cleanup = asyncio.create_task(_cleanup_after(task, listing_dir))
+                _PENDING_CLEANUPS.add(cleanup)
+                cleanup.add_done_callback(_PENDING_CLEANUPS.discard)
 
     return StreamingResponse(stream(), media_type="text/event-stream")
 
@@ -153,7 +186,7 @@ async def process_images(req: ImagesRequest) -> StreamingResponse:
 @app.post("/api/generate-copy")
 async def gen_copy(req: CopyRequest) -> dict:
     try:
-        posts = await generate_posts(req.listing)
+        posts = await generate_posts(req.listing, refresh=req.refresh)
         return {"facebook": posts.facebook, "instagram": posts.instagram}
     except Exception:
         logger.exception("Copy generation failed")
@@ -23,7 +23,7 @@ function Editor({ platform, value, onChange, minWords, maxWords }: EditorProps)
     const resp = await fetch("/api/generate-copy", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ listing }),
+      body: JSON.stringify({ listing, refresh: true }),
     });
     if (!resp.ok) return;
     const data = await resp.json();